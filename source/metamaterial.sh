@@ -32,6 +32,10 @@ echo "======= PULP =============== <><><><><><><><><><><><><><> <><><><><><><><>
 conda install pulp -y
 echo " "
 echo "____________________________ ____________________________ ____________________________"
+echo "======= NUMBA ============== <><><><><><><><><><><><><><> <><><><><><><><><><><><><><>"
+conda install numba -y
+echo " "
+echo "____________________________ ____________________________ ____________________________"
 echo "____________________________ ____________________________ ____________________________"
 echo "____________________________ ____________________________ ____________________________"
 cd ./cython
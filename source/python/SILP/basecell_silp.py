@@ -39,19 +39,22 @@ along with this program.  If not, see https://www.gnu.org/licenses
 """
 
 #%% Imports
-import os, sys, gc
+import os, sys, io, hashlib
+import multiprocessing as mp
 import numpy as np
 from time import perf_counter
+from array import array
 from datetime import datetime
-from scipy.sparse import coo_matrix
+from scipy.sparse import coo_matrix, csr_matrix
 from sksparse.cholmod import analyze
 
 from mesh import get_mesh, get_fmesh
 from elem import get_emat, get_augmat
-from filters import get_sfil, get_mope
-from rem_islands import visit, get_neighbors
-from topopt import update, ws
-from ilp_solver import solve_ILP, solve_BESO
+from filters import get_sfil, get_mope, apply_fil, update_mom, erode, dilate
+from rem_islands import remove_islands, get_neighbors
+from topopt import csc_perm, reduced_perm, csc_assemble_fixed, update, elem_energy, homogenize, ws
+from ilp_solver import solve_ILP, solve_BESO, build_selection
+from storage import extend_buffers, save_aligned, open_buffer, close_buffer
 
 sys.path.append('../../cython/')
 from silp_sens import cgs
@@ -74,8 +77,10 @@ pk = 1e-9         # soft-kill parameter
 small = 1e-14     # small value to compare float numbers
 
 noptf   = 7       # number of optimizations to be stored in the same file
+nbuf    = 2048    # initial number of iterations in the storage buffers
 fid_ini = 0       # initial input index |run from input 0
 fid_lim = 18382   # input index limit   |up to input 18381
+njobs   = 1       # number of output files optimized in parallel (worker processes)
 
 # area = 6*Lx*Ly = 1.0
 Lx = 1.0/(108**0.25)  # design domain shorter side
@@ -144,8 +149,17 @@ xt = np.ndarray((Nt),dtype=bool)  # symmetric density vector
 for k in range(N):
     xt[sym[k,:]] = x_init[k]
 
+# Cached Extended Mesh Operators (keyed on the mesh and the filter radii)
+key = hashlib.sha1(b''.join([np.int64(Ns).tobytes(),coor.tobytes(),inci.tobytes(),sym.tobytes(),
+                             np.float64(rsen).tobytes(),np.float64(rmor).tobytes()])).hexdigest()[:16]
+if not os.path.exists('./cache'):
+    os.mkdir('./cache')
+sfil_path = './cache/sfil_{}.npz'.format(key)
+mfil_path = './cache/mfil_{}.npz'.format(key)
+neig_path = './cache/neighbors_{}.npy'.format(key)
+
 # Generate Extended Mesh
-if (not os.path.exists('./sfil_data.npy')) or (not os.path.exists('./mfil_data.npy')) or (not os.path.exists('./neighbors.npy')):
+if (not os.path.exists(sfil_path)) or (not os.path.exists(mfil_path)) or (not os.path.exists(neig_path)):
     ### numbering rule
     ###                     ____ ____ ____ ____
     ###                    32   31   30   29  28 
@@ -177,17 +191,11 @@ if (not os.path.exists('./sfil_data.npy')) or (not os.path.exists('./mfil_data.n
     coor_lb, coor_bot, inci_lb, inci_bot, sym_lb, sym_bot = get_fmesh(Ns, Lx, Ly, Lex, Ley)
 
 # Sensitivity and Morphology Filters Matrices
-if os.path.exists('./sfil_data.npy') and os.path.exists('./mfil_data.npy'):
-    data = np.load('./sfil_data.npy')
-    row  = np.load('./sfil_row.npy')
-    col  = np.load('./sfil_col.npy')
-    Sf = coo_matrix((data,(row,col)),shape=(N,N))
-    Sf = Sf.tocsr()
-    data = np.load('./mfil_data.npy')
-    row  = np.load('./mfil_row.npy')
-    col  = np.load('./mfil_col.npy')
-    Mf = coo_matrix((data,(row,col)),shape=(N,N))
-    Mf = Mf.tocsr()              
+if os.path.exists(sfil_path) and os.path.exists(mfil_path):
+    with np.load(sfil_path) as arrs:
+        Sf = csr_matrix((arrs['data'],arrs['indices'],arrs['indptr']),shape=(N,N))
+    with np.load(mfil_path) as arrs:
+        Mf = csr_matrix((arrs['data'],arrs['indices'],arrs['indptr']),shape=(N,N))
 else:
     # extended mesh
     fcoor = np.vstack((coor,coor_lb,coor_bot))
@@ -198,26 +206,21 @@ else:
     col = np.repeat(np.arange(N),10)
     data = np.ones(10*N)
     Q = coo_matrix((data,(row,col)),shape=(10*N,N))
-    Q = Q.tocsc()
+    Q = Q.tocsr()
     # sensitivity filter matrix
-    Sf = get_sfil(N,sym,elepos,Q,rsen)
-    Sfcoo = Sf.tocoo()
-    np.save('./sfil_data.npy',Sfcoo.data)
-    np.save('./sfil_row.npy',Sfcoo.row)
-    np.save('./sfil_col.npy',Sfcoo.col)
+    Sf = get_sfil(N,sym,elepos,Q,rsen).tocsr()
+    np.savez(sfil_path,data=Sf.data,indices=Sf.indices,indptr=Sf.indptr)
     # morphology filter matrix
-    Mf = get_mope(N,sym,elepos,Q,rmor)
-    Mfcoo = Mf.tocoo()
-    np.save('./mfil_data.npy',Mfcoo.data)
-    np.save('./mfil_row.npy',Mfcoo.row)
-    np.save('./mfil_col.npy',Mfcoo.col)
+    Mf = get_mope(N,sym,elepos,Q,rmor).tocsr()
+    np.savez(mfil_path,data=Mf.data,indices=Mf.indices,indptr=Mf.indptr)
+Mf_indptr, Mf_indices = Mf.indptr, Mf.indices
 
 # Get Neighbors
-if os.path.exists('./neighbors.npy'):
-    neighbors = np.load('./neighbors.npy')
+if os.path.exists(neig_path):
+    neighbors = np.load(neig_path)
 else:
     neighbors = get_neighbors(Ns,inci,inci_lb,inci_bot,sym,sym_lb,sym_bot)
-    np.save('./neighbors.npy',neighbors)
+    np.save(neig_path,neighbors)
 
 # Periodic Boundary Conditions
 # constraint matrix
@@ -254,8 +257,9 @@ if not os.path.exists('../input'):
     os.mkdir('../input')
 if not os.path.exists('./output'):
     os.mkdir('./output')
-if not os.path.exists('./output/run_{:05d}_{:05d}'.format(fid_ini,fid_lim-1)):
-    os.mkdir('./output/run_{:05d}_{:05d}'.format(fid_ini,fid_lim-1))
+run_dir = './output/run_{:05d}_{:05d}'.format(fid_ini,fid_lim-1)
+if not os.path.exists(run_dir):
+    os.mkdir(run_dir)
 
 # check input
 if not os.path.exists('../input/inputmat.npy'):
@@ -267,10 +271,10 @@ if not os.path.exists('../input/inputmat.npy'):
 inputmat = np.load('../input/inputmat.npy')
 
 # open log files
-if not os.path.exists('./output/run_{:05d}_{:05d}/logs'.format(fid_ini,fid_lim-1)):
-    os.mkdir('./output/run_{:05d}_{:05d}/logs'.format(fid_ini,fid_lim-1))
-iolog = open('./output/run_{:05d}_{:05d}/logs/io_log.txt'.format(fid_ini,fid_lim-1),'a')
-tlog = open('./output/run_{:05d}_{:05d}/logs/time_log.txt'.format(fid_ini,fid_lim-1),'a')
+if not os.path.exists(run_dir+'/logs'):
+    os.mkdir(run_dir+'/logs')
+iolog = open(run_dir+'/logs/io_log.txt','a')
+tlog = open(run_dir+'/logs/time_log.txt','a')
 iolog.truncate(0)
 tlog.truncate(0)
 
@@ -316,105 +320,107 @@ tlog.write('      INPUT || (  IT x ):    M-ILP : M-SOLVER :    M-CGS :     M-WS
 # COO data
 pen = np.ones(Nt)
 pen[~xt] = pk
-data = np.ndarray((64*Nt))
-for et in range(Nt):
-    ek = etype[et]
-    data[64*et:64*et+64] = pen[et]*Ketvec[ek,:]
+data = (pen[:,None]*Ketvec[etype]).ravel()
 # COO indices
-dof0 = 2*inci[:,0]
-dof1 = dof0 + 1
-dof2 = 2*inci[:,1]
-dof3 = dof2 + 1
-dof4 = 2*inci[:,2]
-dof5 = dof4 + 1
-dof6 = 2*inci[:,3]
-dof7 = dof6 + 1
-eledofs = np.array([dof0,dof1,dof2,dof3,dof4,dof5,dof6,dof7])
+eledofs = np.ndarray((8,Nt),dtype=np.int32)
+eledofs[0::2] = 2*inci.T
+eledofs[1::2] = eledofs[0::2] + 1
 row = eledofs.repeat(8,axis=0).ravel('F')
 col = eledofs.T.repeat(8,axis=0).ravel('C')
 # stiffness matrix
 Kg_coo_init = coo_matrix((data,(row,col)),shape=(G,G))
 Kg_csc = Kg_coo_init.tocsc()
-Kr = P.T @ Kg_csc @ P
-# maneuver to fix the pattern of non-zero entries
-Z_coo = coo_matrix((np.ones(64*Nt),(row,col)),shape=(G,G))
-Z_csc = Z_coo.tocsc()
-Zr = P.T @ Z_csc @ P
-Zr.sort_indices()
-shift = 10*np.amax(abs(Ket))
-Kr = Kr + shift*Zr
+Kg_data_init = Kg_coo_init.data.copy()  # COO data of the initial topology
+Kg_data = np.ndarray((64*Nt))
+perm = csc_perm(row,col,Kg_csc)  # COO entries > CSC data (fixed pattern)
+# reduced stiffness matrix with the full (symbolic) pattern of non-zero entries
+Z_csc = Kg_csc.copy()
+Z_csc.data[:] = 1.0
+Kr = P.T @ Z_csc @ P
 Kr.sort_indices()
-Kr.data = Kr.data - shift*Zr.data
+rperm = reduced_perm(P,Kg_csc,Kr)  # Kg_csc data > Kr data (fixed pattern)
+csc_assemble_fixed(Kg_csc.data,rperm,Kr.data)
 # right-hand side
 Fr = -P.T @ Kg_csc @ Uhat
 
 # Solve System
-# analyze sparse matrix
-factor = analyze(Kr)
+# analyze sparse matrix (supernodal, best of the available orderings)
+factor = analyze(Kr,mode='supernodal',ordering_method='best')
 # call solver
 factor.cholesky_inplace(Kr)
-Ur = factor(Fr)
+Ur = factor.solve_A(Fr)
 Ug_init = Uhat + P @ Ur
 
 # Effective Properties Matrix
-Ch_init = Ug_init.T @ Kg_csc @ Ug_init
+Ch_init = homogenize(x_init,sym,etype,inci,pk,Ket,Ug_init)
+# element energies of the unit strain fields (incremental update of Ch)
+Che = elem_energy(sym,etype,inci,Ket,Uhat)
+Chat_init = homogenize(x_init,sym,etype,inci,pk,Ket,Uhat)
 gamma_init = Ch_init[2,2]/Ch_init[0,0]
 nuhat_init = 1-2*Ch_init[2,2]/Ch_init[0,0]
 Eyhat_init = 4*Ch_init[2,2]*(Ch_init[0,0]-Ch_init[2,2])/Ch_init[0,0]
-vol_init = sum(x_init)/N
+vol_init = np.count_nonzero(x_init)/N
 
 # initialize sensitivity arrays
-s_Ey = np.ndarray((N))
-s_obj = np.ndarray((N))
-dC00_0_init = np.ndarray((N))
-dC11_0_init = np.ndarray((N))
-dC22_0_init = np.ndarray((N))
-dC00_1_init = np.ndarray((N))
-dC11_1_init = np.ndarray((N))
-dC22_1_init = np.ndarray((N))
-dC00_2_init = np.ndarray((N))
-dC11_2_init = np.ndarray((N))
-dC22_2_init = np.ndarray((N))
-cgs(dC00_0_init,dC11_0_init,dC22_0_init,dC00_1_init,dC11_1_init,dC22_1_init,
-    dC00_2_init,dC11_2_init,dC22_2_init,x_init,N,sym,etype,aug_etype,inci,Ug_init,dKe,P,Kr,dKelist)
-dC00_w_init, dC11_w_init, dC22_w_init = ws(x_init,aug_etype,sym,P,factor,inci,Ug_init,Hlist)
+fil_Ey = np.ndarray((N))
+fil_obj = np.ndarray((N))
+mom_obj = np.ndarray((N))
+selection = np.ndarray((N),dtype=bool)
+ywork = np.ndarray((N),dtype=bool)
+# dC_cgs[i,k] : CGS-k sensitivity of Ch[i,i] / dC_ws[i] : WS sensitivity of Ch[i,i]
+dC_cgs_init = np.ndarray((3,3,N))
+dC_ws_init = np.ndarray((3,N))
+cgs(dC_cgs_init[0,0],dC_cgs_init[1,0],dC_cgs_init[2,0],dC_cgs_init[0,1],dC_cgs_init[1,1],dC_cgs_init[2,1],
+    dC_cgs_init[0,2],dC_cgs_init[1,2],dC_cgs_init[2,2],x_init,N,sym,etype,aug_etype,inci,Ug_init,dKe,P,Kr,dKelist)
+ws(x_init,aug_etype,sym,P,factor,inci,Ug_init,Hlist,dC_ws_init)
+dC_cgs = np.ndarray((3,3,N))
+dC_ws = np.ndarray((3,N))
+dC00_0, dC00_1, dC00_2 = dC_cgs[0]  # views of the sensitivity buffers
+dC11_0, dC11_1, dC11_2 = dC_cgs[1]
+dC22_0, dC22_1, dC22_2 = dC_cgs[2]
+dC00_w, dC11_w, dC22_w = dC_ws
+# stored sensitivity channels (CGS-0, CGS-1, CGS-2 and WS of Ch[0,0], Ch[1,1] and Ch[2,2])
+dC_names = ['dC00_0','dC00_1','dC00_2','dC00_w','dC11_0','dC11_1','dC11_2','dC11_w','dC22_0','dC22_1','dC22_2','dC22_w']
+dC_views = [dC00_0,dC00_1,dC00_2,dC00_w,dC11_0,dC11_1,dC11_2,dC11_w,dC22_0,dC22_1,dC22_2,dC22_w]
 
 #%% Setup Optimization
 
-file = 0  # file counter
-fid = max([0,fid_ini])
-while fid < min([fid_lim,inputmat.shape[0]]):
-    if not os.path.exists('./output/run_{:05d}_{:05d}/file_{:04d}'.format(fid_ini,fid_lim-1,file)):
-        os.mkdir('./output/run_{:05d}_{:05d}/file_{:04d}'.format(fid_ini,fid_lim-1,file)) 
-
-    # initialize lists
-    list_fid     = []
-    list_inp     = []
-    list_top_opt = []
-    list_nu_opt  = []
-    list_Ey_opt  = []
-    list_ptr2opt = []
-    list_ptr2inp = []
-    list_top     = []
-    list_dis_xx  = []
-    list_dis_yy  = []
-    list_dis_xy  = []
-    list_dC00_0  = []
-    list_dC00_1  = []
-    list_dC00_2  = []
-    list_dC00_w  = []
-    list_dC11_0  = []
-    list_dC11_1  = []
-    list_dC11_2  = []
-    list_dC11_w  = []
-    list_dC22_0  = []
-    list_dC22_1  = []
-    list_dC22_2  = []
-    list_dC22_w  = []
-    list_nu      = []
-    list_Ey      = []
-    list_vol     = []
-    list_tim     = []
+def run_file(file,iolog,tlog):
+    # optimizations of the inputs stored in the output file 'file'
+    fid = max([0,fid_ini]) + file*noptf
+    file_dir = run_dir + '/file_{:04d}'.format(file)
+    if not os.path.exists(file_dir):
+        os.mkdir(file_dir)
+
+    # initialize index lists (unsigned 32-bit)
+    list_fid     = array('I')
+    list_ptr2opt = array('I')
+    list_ptr2inp = array('I')
+    
+    # initialize storage arrays (one row per optimization)
+    opt = {'inp'     : np.ndarray((noptf,2),dtype=np.float32),
+           'top_opt' : np.ndarray((noptf,(N+7)//8),dtype=np.uint8),  # bit-packed topologies
+           'nu_opt'  : np.ndarray((noptf),dtype=np.float32),
+           'Ey_opt'  : np.ndarray((noptf),dtype=np.float32),
+           'tim'     : np.ndarray((noptf,7),dtype=np.float32)}
+    
+    # initialize storage buffers (one row per iteration)
+    buf = {'top'    : np.ndarray((nbuf,(N+7)//8),dtype=np.uint8),  # bit-packed topologies
+           'dis_xx' : np.ndarray((nbuf,G),dtype=np.float32),
+           'dis_yy' : np.ndarray((nbuf,G),dtype=np.float32),
+           'dis_xy' : np.ndarray((nbuf,G),dtype=np.float32),
+           'nu'     : np.ndarray((nbuf),dtype=np.float32),
+           'Ey'     : np.ndarray((nbuf),dtype=np.float32),
+           'vol'    : np.ndarray((nbuf),dtype=np.float32)}
+    for name in dC_names:  # sensitivity fields are memory-mapped to their output files
+        buf[name] = open_buffer(file_dir+'/'+name+'.npy',nbuf,(N,),np.float32)
+    size_list = 0  # number of stored iterations
+    
+    # topology work vectors (reused by all optimizations of the file)
+    x       = np.ndarray((N),dtype=bool)  # current topology
+    y       = np.ndarray((N),dtype=bool)  # candidate topology
+    top_opt = np.ndarray((N),dtype=bool)  # optimized topology thus far
+    Chat    = np.ndarray((3,3))
     
     ptr = 0  # pointer to input
     for counter in range(noptf):
@@ -428,8 +434,8 @@ while fid < min([fid_lim,inputmat.shape[0]]):
         
         nuval = inputmat[fid,0]  # target Poisson's ratio
         Eymin = inputmat[fid,1]  # minimal Young's modulus
-        list_fid += [fid]
-        list_inp += [[nuval,Eymin]]
+        list_fid.append(fid)
+        opt['inp'][ptr] = [nuval,Eymin]
         
         # write in log
         iolog.write(' {:5.2f} :'.format(nuval))
@@ -437,26 +443,17 @@ while fid < min([fid_lim,inputmat.shape[0]]):
         begin = datetime.now().strftime(' %y/%m/%d-%H:%M:%S :')
         
         # get initial data
-        x      = x_init.copy()
-        Kg_coo = Kg_coo_init.copy()
+        x[:]   = x_init
+        Kg_data[:] = Kg_data_init
         Ug     = Ug_init.copy()
         Ch     = Ch_init.copy()
+        Chat[:] = Chat_init
         gamma  = gamma_init
         nuhat  = nuhat_init
         Eyhat  = Eyhat_init
         vol    = vol_init
-        dC00_0 = dC00_0_init.copy()
-        dC00_1 = dC00_1_init.copy()
-        dC00_2 = dC00_2_init.copy()
-        dC00_w = dC00_w_init.copy()
-        dC11_0 = dC11_0_init.copy()
-        dC11_1 = dC11_1_init.copy()
-        dC11_2 = dC11_2_init.copy()
-        dC11_w = dC11_w_init.copy()
-        dC22_0 = dC22_0_init.copy()
-        dC22_1 = dC22_1_init.copy()
-        dC22_2 = dC22_2_init.copy()
-        dC22_w = dC22_w_init.copy()
+        dC_cgs[:] = dC_cgs_init
+        dC_ws[:]  = dC_ws_init
         
         # target Poisson's ratio (limited variation)
         if nuhat > nuval:
@@ -471,51 +468,39 @@ while fid < min([fid_lim,inputmat.shape[0]]):
         eta_Ey = max([fEy - Eyvar, 0.0])
         
         # sensitivity analysis
-        for e in range(N):
-            ggamma = (Ch[2,2]+dC22_w[e])/(Ch[0,0]+dC00_w[e])
-            dnu = 2.0*(gamma*dC00_w[e]-dC22_w[e])/(Ch[0,0]+dC00_w[e])
-            dEy = 4.0*(1.0-ggamma)*dC22_w[e] + 2.0*Ch[2,2]*dnu
-            dobj = 2.0*(nuhat-nu_g)*dnu + dnu*dnu
-            if x[e]:
-                s_Ey[e]  = -dEy
-                s_obj[e] = -dobj
-            else:
-                s_Ey[e]  =  dEy
-                s_obj[e] =  dobj
+        den = Ch[0,0] + dC00_w
+        ggamma = (Ch[2,2]+dC22_w)/den
+        dnu = 2.0*(gamma*dC00_w-dC22_w)/den
+        dEy = 4.0*(1.0-ggamma)*dC22_w + 2.0*Ch[2,2]*dnu
+        dobj = 2.0*(nuhat-nu_g)*dnu + dnu*dnu
+        sign = np.where(x,-1.0,1.0)
+        s_Ey  = sign*dEy
+        s_obj = sign*dobj
         raw_obj = s_obj + beta/N
         obj = fnu_g + beta*vol
-        fil_Ey  = Sf @ s_Ey
-        fil_obj = Sf @ raw_obj
-        mom_obj = np.zeros(N)
-        mom_obj = momentum*mom_obj + (1.0-momentum)*fil_obj/max(abs(fil_obj))
-        mom_obj = mom_obj/max(abs(mom_obj))
+        apply_fil(Sf,s_Ey,fil_Ey)
+        apply_fil(Sf,raw_obj,fil_obj)
+        mom_obj[:] = 0.0
+        update_mom(mom_obj,fil_obj,momentum)
         
         # store data
-        size_list = len(list_ptr2inp)
-        list_ptr2opt += [size_list]
-        list_ptr2inp += [ptr]
-        list_top     += [x.copy()]
-        list_dis_xx  += [Ug[:,0].copy()]
-        list_dis_yy  += [Ug[:,1].copy()]
-        list_dis_xy  += [Ug[:,2].copy()]
-        list_dC00_0  += [dC00_0.copy()]
-        list_dC00_1  += [dC00_1.copy()]
-        list_dC00_2  += [dC00_2.copy()]
-        list_dC00_w  += [dC00_w.copy()]
-        list_dC11_0  += [dC11_0.copy()]
-        list_dC11_1  += [dC11_1.copy()]
-        list_dC11_2  += [dC11_2.copy()]
-        list_dC11_w  += [dC11_w.copy()]
-        list_dC22_0  += [dC22_0.copy()]
-        list_dC22_1  += [dC22_1.copy()]
-        list_dC22_2  += [dC22_2.copy()]
-        list_dC22_w  += [dC22_w.copy()]
-        list_nu      += [nuhat]
-        list_Ey      += [Eyhat]
-        list_vol     += [vol]
+        list_ptr2opt.append(size_list)
+        list_ptr2inp.append(ptr)
+        if size_list == len(buf['top']):
+            extend_buffers(buf)
+        buf['top'][size_list]    = np.packbits(x)
+        buf['dis_xx'][size_list] = Ug[:,0]
+        buf['dis_yy'][size_list] = Ug[:,1]
+        buf['dis_xy'][size_list] = Ug[:,2]
+        for name, dC in zip(dC_names,dC_views):
+            buf[name][size_list] = dC
+        buf['nu'][size_list]     = nuhat
+        buf['Ey'][size_list]     = Eyhat
+        buf['vol'][size_list]    = vol
+        size_list += 1
         
         # optimized topology thus far
-        top_opt = x.copy()
+        top_opt[:] = x
         nu_opt = nuhat
         Ey_opt = Eyhat
         obj_opt = obj
@@ -532,9 +517,9 @@ while fid < min([fid_lim,inputmat.shape[0]]):
             
             # solve ILP
             t0 = perf_counter()
-            selection = (x & (mom_obj>-small)) | ((~x) & (mom_obj<small)) | (x & (fil_Ey<small)) | ((~x) & (fil_Ey>-small))
-            Nsel = sum(selection)
-            y = x.copy()
+            build_selection(x,mom_obj,fil_Ey,small,selection)
+            Nsel = np.count_nonzero(selection)
+            y[:] = x
             if Nsel > 0:
                 if (Eymin + eta_Ey) < small:
                     ysel = solve_BESO(Nsel,x[selection],mom_obj[selection],dXmax)
@@ -543,41 +528,31 @@ while fid < min([fid_lim,inputmat.shape[0]]):
                     ysel = solve_ILP(Nsel,x[selection],mom_obj[selection],fil_Ey[selection],fEy,eta_Ey,dXmax,sense_h='G')
                     y[selection] = ysel
             # open operator (erode + dilate)
-            y[Mf[~y,:].indices] = False
-            y[Mf[y,:].indices] = True
+            erode(y,Mf_indptr,Mf_indices,ywork)
+            dilate(y,Mf_indptr,Mf_indices,ywork)
             # remove islands
-            voly = sum(y)/N
-            continent = np.zeros(N,dtype=bool)
-            continent_vol = 0.0
-            for e in (list(range(0,Ns))+list(range(Ns,N,Ns))):
-                if y[e] and (not continent[e]):
-                    continent = np.zeros(N,dtype=bool)    
-                    visit(e,y,continent,neighbors)
-                    continent_vol = sum(continent)/N
-                if continent_vol > 0.50*voly:
-                    break
+            voly = np.count_nonzero(y)/N
+            continent, continent_vol = remove_islands(y,neighbors,Ns,N)
             if continent_vol > 0.50*voly:
-                islands = np.argwhere(y!=continent).ravel()
+                islands = np.flatnonzero(y!=continent)
                 if len(islands) > dXmax:
                     sortedargs = np.argsort(abs(fil_Ey[islands]))
                     y[islands[sortedargs[:dXmax]]] = False
                 else:
                     y[islands] = False
             # erode if nothing has been changed
-            if all(x==y):
+            if np.array_equal(x,y):
                 print('--- erode ---')
-                y[Mf[~y,:].indices] = False
+                erode(y,Mf_indptr,Mf_indices,ywork)
             t1 = perf_counter()
             time_array[0] += (t1-t0)
             
             # update topology
             t0 = perf_counter()
-            if any(x!=y):
-                elist = list(np.argwhere(x!=y)[:,0])
-                Ug, Kr = update(x,etype,sym,pk,Ketvec,P,Kg_coo,Zr,shift,Uhat,factor,elist)
+            if not np.array_equal(x,y):
+                elist = np.flatnonzero(x!=y)
+                Ug, Ch = update(x,etype,sym,pk,Ketvec,P,Kg_data,Kg_csc,perm,Kr,rperm,Uhat,factor,elist,inci,Ket,Che,Chat)
             # compute homogenized properties
-            Kg_csc = Kg_coo.tocsc()
-            Ch = Ug.T @ Kg_csc @ Ug
             gamma = Ch[2,2]/Ch[0,0]
             nuhat = 1-2*Ch[2,2]/Ch[0,0]
             Eyhat = 4*Ch[2,2]*(Ch[0,0]-Ch[2,2])/Ch[0,0]
@@ -587,23 +562,21 @@ while fid < min([fid_lim,inputmat.shape[0]]):
                 eta_nu = min([nuhat - nuval + nuvar, 0.0])
             nu_g = nuval + eta_nu
             fnu_g = (nuhat-nu_g)**2
-            vol = sum(x)/N
+            vol = np.count_nonzero(x)/N
             obj = fnu_g + beta*vol
             fEy_test = Eyhat-Eymin
             eta_Ey_test = max([fEy_test - Eyvar, 0.0])
             # go back to last topology and dilate if constraint is broken
             if fEy_test < 0.0:
                 # go back to last topology
-                update(x,etype,sym,pk,Ketvec,P,Kg_coo,Zr,shift,Uhat,factor,elist,solve_sys=False)
+                update(x,etype,sym,pk,Ketvec,P,Kg_data,Kg_csc,perm,Kr,rperm,Uhat,factor,elist,inci,Ket,Che,Chat,solve_sys=False)
                 # dilate
                 print('--- dilate ---')
-                y = x.copy()
-                y[Mf[y,:].indices] = True
-                elist = list(np.argwhere(x!=y)[:,0])
+                y[:] = x
+                dilate(y,Mf_indptr,Mf_indices,ywork)
+                elist = np.flatnonzero(x!=y)
                 # compute homogenized properties
-                Ug, Kr = update(x,etype,sym,pk,Ketvec,P,Kg_coo,Zr,shift,Uhat,factor,elist)
-                Kg_csc = Kg_coo.tocsc()
-                Ch = Ug.T @ Kg_csc @ Ug
+                Ug, Ch = update(x,etype,sym,pk,Ketvec,P,Kg_data,Kg_csc,perm,Kr,rperm,Uhat,factor,elist,inci,Ket,Che,Chat)
                 gamma = Ch[2,2]/Ch[0,0]
                 nuhat = 1-2*Ch[2,2]/Ch[0,0]
                 Eyhat = 4*Ch[2,2]*(Ch[0,0]-Ch[2,2])/Ch[0,0]
@@ -613,7 +586,7 @@ while fid < min([fid_lim,inputmat.shape[0]]):
                     eta_nu = min([nuhat - nuval + nuvar, 0.0])
                 nu_g = nuval + eta_nu
                 fnu_g = (nuhat-nu_g)**2
-                vol = sum(x)/N
+                vol = np.count_nonzero(x)/N
                 obj = fnu_g + beta*vol
                 fEy = Eyhat-Eymin
                 eta_Ey = max([fEy - Eyvar, 0.0])
@@ -632,58 +605,47 @@ while fid < min([fid_lim,inputmat.shape[0]]):
             
             # WS analysis for dCh
             t0 = perf_counter()
-            dC00_w, dC11_w, dC22_w = ws(x,aug_etype,sym,P,factor,inci,Ug,Hlist)
+            ws(x,aug_etype,sym,P,factor,inci,Ug,Hlist,dC_ws)
             t1 = perf_counter()
             time_array[3] += (t1-t0)
             
             # post-procedures
             t0 = perf_counter()
             # sensitivity analysis for obj and Ey
-            for e in range(N):
-                ggamma = (Ch[2,2]+dC22_w[e])/(Ch[0,0]+dC00_w[e])
-                dnu = 2.0*(gamma*dC00_w[e]-dC22_w[e])/(Ch[0,0]+dC00_w[e])
-                dEy = 4.0*(1.0-ggamma)*dC22_w[e] + 2.0*Ch[2,2]*dnu
-                dobj = 2.0*(nuhat-nu_g)*dnu + dnu*dnu
-                if x[e]:
-                    s_Ey[e]  = -dEy
-                    s_obj[e] = -dobj
-                else:
-                    s_Ey[e]  =  dEy
-                    s_obj[e] =  dobj
+            den = Ch[0,0] + dC00_w
+            ggamma = (Ch[2,2]+dC22_w)/den
+            dnu = 2.0*(gamma*dC00_w-dC22_w)/den
+            dEy = 4.0*(1.0-ggamma)*dC22_w + 2.0*Ch[2,2]*dnu
+            dobj = 2.0*(nuhat-nu_g)*dnu + dnu*dnu
+            sign = np.where(x,-1.0,1.0)
+            s_Ey  = sign*dEy
+            s_obj = sign*dobj
             raw_obj = s_obj + beta/N
             obj = fnu_g + beta*vol
-            fil_Ey  = Sf @ s_Ey
-            fil_obj = Sf @ raw_obj
-            mom_obj = momentum*mom_obj + (1.0-momentum)*fil_obj/max(abs(fil_obj))
-            mom_obj = mom_obj/max(abs(mom_obj))
+            apply_fil(Sf,s_Ey,fil_Ey)
+            apply_fil(Sf,raw_obj,fil_obj)
+            update_mom(mom_obj,fil_obj,momentum)
             # store data
-            list_ptr2inp += [ptr]
-            list_top     += [x.copy()]
-            list_dis_xx  += [Ug[:,0].copy()]
-            list_dis_yy  += [Ug[:,1].copy()]
-            list_dis_xy  += [Ug[:,2].copy()]
-            list_dC00_0  += [dC00_0.copy()]
-            list_dC00_1  += [dC00_1.copy()]
-            list_dC00_2  += [dC00_2.copy()]
-            list_dC00_w  += [dC00_w.copy()]
-            list_dC11_0  += [dC11_0.copy()]
-            list_dC11_1  += [dC11_1.copy()]
-            list_dC11_2  += [dC11_2.copy()]
-            list_dC11_w  += [dC11_w.copy()]
-            list_dC22_0  += [dC22_0.copy()]
-            list_dC22_1  += [dC22_1.copy()]
-            list_dC22_2  += [dC22_2.copy()]
-            list_dC22_w  += [dC22_w.copy()]
-            list_nu      += [nuhat]
-            list_Ey      += [Eyhat]
-            list_vol     += [vol]
+            list_ptr2inp.append(ptr)
+            if size_list == len(buf['top']):
+                extend_buffers(buf)
+            buf['top'][size_list]    = np.packbits(x)
+            buf['dis_xx'][size_list] = Ug[:,0]
+            buf['dis_yy'][size_list] = Ug[:,1]
+            buf['dis_xy'][size_list] = Ug[:,2]
+            for name, dC in zip(dC_names,dC_views):
+                buf[name][size_list] = dC
+            buf['nu'][size_list]     = nuhat
+            buf['Ey'][size_list]     = Eyhat
+            buf['vol'][size_list]    = vol
+            size_list += 1
             # stopping criterion
             if ((obj<(1.0-small)*obj_opt) or (abs(nuhat-nuval)<(1.0-small)*abs(nu_opt-nuval))) and (Eyhat>Eymin-small):
                 waiting = 0
                 obj_opt = obj
                 if (abs(nuhat-nuval)<(1.0-small)*abs(nu_opt-nuval)):
                     # update optimized topology
-                    top_opt = x.copy()
+                    top_opt[:] = x
                     nu_opt  = nuhat
                     Ey_opt  = Eyhat
             else:
@@ -695,36 +657,26 @@ while fid < min([fid_lim,inputmat.shape[0]]):
             time_array[4] += (t1-t0)
 
         # remove remaining islands from optimized topology
-        y = top_opt.copy()
-        voly = sum(y)/N
-        continent = np.zeros(N,dtype=bool)
-        continent_vol = 0.0
-        for e in (list(range(0,Ns))+list(range(Ns,N,Ns))):
-            if y[e] and (not continent[e]):
-                continent = np.zeros(N,dtype=bool)    
-                visit(e,y,continent,neighbors)
-                continent_vol = sum(continent)/N
-            if continent_vol > 0.50*voly:
-                break
+        y[:] = top_opt
+        voly = np.count_nonzero(y)/N
+        continent, continent_vol = remove_islands(y,neighbors,Ns,N)
         if continent_vol > 0.50*voly:
-            islands = np.argwhere(y!=continent).ravel()
+            islands = np.flatnonzero(y!=continent)
             y[islands] = False
-        if any(top_opt!=y):
-            if any(x!=y):
-                elist = list(np.argwhere(x!=y)[:,0])
-                Ug, Kr = update(x,etype,sym,pk,Ketvec,P,Kg_coo,Zr,shift,Uhat,factor,elist)
-                Kg_csc = Kg_coo.tocsc()
-                Ch = Ug.T @ Kg_csc @ Ug
+        if not np.array_equal(top_opt,y):
+            if not np.array_equal(x,y):
+                elist = np.flatnonzero(x!=y)
+                Ug, Ch = update(x,etype,sym,pk,Ketvec,P,Kg_data,Kg_csc,perm,Kr,rperm,Uhat,factor,elist,inci,Ket,Che,Chat)
                 gamma = Ch[2,2]/Ch[0,0]
                 nuhat = 1-2*Ch[2,2]/Ch[0,0]
                 Eyhat = 4*Ch[2,2]*(Ch[0,0]-Ch[2,2])/Ch[0,0]
-            top_opt = x.copy()
+            top_opt[:] = x
             nu_opt = nuhat
             Ey_opt = Eyhat
 
         # write in log
         tlog.write(' ({:4d} x ):'.format(it))
-        time_array[5] = sum(time_array[:5])
+        time_array[5] = time_array[:5].sum()
         time_array[:5] = time_array[:5]/it
         time_array[6] = (1+small)*it
         tlog.write(' {:6.3f} s : {:6.3f} s : {:6.3f} s : {:6.3f} s : {:6.3f} s ||'.format(
@@ -736,10 +688,10 @@ while fid < min([fid_lim,inputmat.shape[0]]):
         iolog.write(datetime.now().strftime(' %y/%m/%d-%H:%M:%S\n'))
 
         # store data
-        list_top_opt += [top_opt.copy()]
-        list_nu_opt  += [nu_opt]
-        list_Ey_opt  += [Ey_opt]
-        list_tim     += [time_array.copy()]
+        opt['top_opt'][ptr] = np.packbits(top_opt)
+        opt['nu_opt'][ptr]  = nu_opt
+        opt['Ey_opt'][ptr]  = Ey_opt
+        opt['tim'][ptr]     = time_array
         
         # update pointer
         ptr += 1
@@ -748,73 +700,44 @@ while fid < min([fid_lim,inputmat.shape[0]]):
         fid += 1
         
     #%% Write files
-    size_list = len(list_ptr2inp)
-    list_ptr2opt += [size_list]
-    
-    # save files
-    np.save('./output/run_{:05d}_{:05d}/file_{:04d}/fid.npy'.format(
-        fid_ini,fid_lim-1,file),np.array(list_fid,dtype=np.uint32))
-    np.save('./output/run_{:05d}_{:05d}/file_{:04d}/inp.npy'.format(
-        fid_ini,fid_lim-1,file),np.array(list_inp,dtype=np.float32))
-    np.save('./output/run_{:05d}_{:05d}/file_{:04d}/top_opt.npy'.format(
-        fid_ini,fid_lim-1,file),np.packbits(np.array(list_top_opt),axis=1))
-    np.save('./output/run_{:05d}_{:05d}/file_{:04d}/nu_opt.npy'.format(
-        fid_ini,fid_lim-1,file),np.array(list_nu_opt,dtype=np.float32))
-    np.save('./output/run_{:05d}_{:05d}/file_{:04d}/Ey_opt.npy'.format(
-        fid_ini,fid_lim-1,file),np.array(list_Ey_opt,dtype=np.float32))
-    np.save('./output/run_{:05d}_{:05d}/file_{:04d}/ptr2opt.npy'.format(
-        fid_ini,fid_lim-1,file),np.array(list_ptr2opt,dtype=np.uint32))
-    np.save('./output/run_{:05d}_{:05d}/file_{:04d}/ptr2inp.npy'.format(
-        fid_ini,fid_lim-1,file),np.array(list_ptr2inp,dtype=np.uint32))
-    np.save('./output/run_{:05d}_{:05d}/file_{:04d}/top.npy'.format(
-        fid_ini,fid_lim-1,file),np.packbits(np.array(list_top),axis=1))
-    np.save('./output/run_{:05d}_{:05d}/file_{:04d}/dis_xx.npy'.format(
-        fid_ini,fid_lim-1,file),np.array(list_dis_xx,dtype=np.float32))
-    np.save('./output/run_{:05d}_{:05d}/file_{:04d}/dis_yy.npy'.format(
-        fid_ini,fid_lim-1,file),np.array(list_dis_yy,dtype=np.float32))
-    np.save('./output/run_{:05d}_{:05d}/file_{:04d}/dis_xy.npy'.format(
-        fid_ini,fid_lim-1,file),np.array(list_dis_xy,dtype=np.float32))
-    np.save('./output/run_{:05d}_{:05d}/file_{:04d}/dC00_0.npy'.format(
-        fid_ini,fid_lim-1,file),np.array(list_dC00_0,dtype=np.float32))
-    np.save('./output/run_{:05d}_{:05d}/file_{:04d}/dC00_1.npy'.format(
-        fid_ini,fid_lim-1,file),np.array(list_dC00_1,dtype=np.float32))
-    np.save('./output/run_{:05d}_{:05d}/file_{:04d}/dC00_2.npy'.format(
-        fid_ini,fid_lim-1,file),np.array(list_dC00_2,dtype=np.float32))
-    np.save('./output/run_{:05d}_{:05d}/file_{:04d}/dC00_w.npy'.format(
-        fid_ini,fid_lim-1,file),np.array(list_dC00_w,dtype=np.float32))
-    np.save('./output/run_{:05d}_{:05d}/file_{:04d}/dC11_0.npy'.format(
-        fid_ini,fid_lim-1,file),np.array(list_dC11_0,dtype=np.float32))
-    np.save('./output/run_{:05d}_{:05d}/file_{:04d}/dC11_1.npy'.format(
-        fid_ini,fid_lim-1,file),np.array(list_dC11_1,dtype=np.float32))
-    np.save('./output/run_{:05d}_{:05d}/file_{:04d}/dC11_2.npy'.format(
-        fid_ini,fid_lim-1,file),np.array(list_dC11_2,dtype=np.float32))
-    np.save('./output/run_{:05d}_{:05d}/file_{:04d}/dC11_w.npy'.format(
-        fid_ini,fid_lim-1,file),np.array(list_dC11_w,dtype=np.float32))
-    np.save('./output/run_{:05d}_{:05d}/file_{:04d}/dC22_0.npy'.format(
-        fid_ini,fid_lim-1,file),np.array(list_dC22_0,dtype=np.float32))
-    np.save('./output/run_{:05d}_{:05d}/file_{:04d}/dC22_1.npy'.format(
-        fid_ini,fid_lim-1,file),np.array(list_dC22_1,dtype=np.float32))
-    np.save('./output/run_{:05d}_{:05d}/file_{:04d}/dC22_2.npy'.format(
-        fid_ini,fid_lim-1,file),np.array(list_dC22_2,dtype=np.float32))
-    np.save('./output/run_{:05d}_{:05d}/file_{:04d}/dC22_w.npy'.format(
-        fid_ini,fid_lim-1,file),np.array(list_dC22_w,dtype=np.float32))
-    np.save('./output/run_{:05d}_{:05d}/file_{:04d}/nu.npy'.format(
-        fid_ini,fid_lim-1,file),np.array(list_nu,dtype=np.float32))
-    np.save('./output/run_{:05d}_{:05d}/file_{:04d}/Ey.npy'.format(
-        fid_ini,fid_lim-1,file),np.array(list_Ey,dtype=np.float32))
-    np.save('./output/run_{:05d}_{:05d}/file_{:04d}/vol.npy'.format(
-        fid_ini,fid_lim-1,file),np.array(list_vol,dtype=np.float32))
-    np.save('./output/run_{:05d}_{:05d}/file_{:04d}/tim.npy'.format(
-        fid_ini,fid_lim-1,file),np.array(list_tim,dtype=np.float32))
+    list_ptr2opt.append(size_list)
     
-    del list_fid, list_inp, list_top_opt, list_nu_opt, list_Ey_opt, list_ptr2opt, list_ptr2inp, list_top
-    del list_dis_xx, list_dis_yy, list_dis_xy, list_dC00_0, list_dC00_1, list_dC00_2, list_dC00_w
-    del list_dC11_0, list_dC11_1, list_dC11_2, list_dC11_w, list_dC22_0, list_dC22_1, list_dC22_2, list_dC22_w
-    del list_nu, list_Ey, list_vol, list_tim
-    gc.collect()
-    
-    # prepare to write next output file
-    file += 1
+    # save files (one .npy file per quantity)
+    arrays = {'fid'     : np.frombuffer(list_fid,dtype=np.uint32),
+              'ptr2opt' : np.frombuffer(list_ptr2opt,dtype=np.uint32),
+              'ptr2inp' : np.frombuffer(list_ptr2inp,dtype=np.uint32)}
+    for name in opt:  # one row per optimization
+        arrays[name] = opt[name][:ptr]
+    for name in buf:  # one row per stored iteration
+        if isinstance(buf[name],np.memmap):
+            close_buffer(buf[name],size_list)
+        else:
+            arrays[name] = buf[name][:size_list]
+    for name in list(arrays):
+        save_aligned(file_dir+'/'+name+'.npy',arrays.pop(name))
+        # release the storage array as soon as its file is written
+        opt.pop(name,None)
+        buf.pop(name,None)
+    return
+
+def run_file_logged(file):
+    # run_file in a worker process, returning its log records
+    iolog, tlog = io.StringIO(), io.StringIO()
+    run_file(file,iolog,tlog)
+    return iolog.getvalue(), tlog.getvalue()
+
+nfile = -(-(min([fid_lim,inputmat.shape[0]])-max([0,fid_ini]))//noptf)  # number of output files
+if njobs > 1:
+    # forked workers inherit the factorization and all setup arrays (one output file per task)
+    iolog.flush()
+    tlog.flush()
+    with mp.get_context('fork').Pool(njobs) as pool:
+        for iorec, trec in pool.imap(run_file_logged,range(nfile)):
+            iolog.write(iorec)
+            tlog.write(trec)
+else:
+    for file in range(nfile):
+        run_file(file,iolog,tlog)
     
 #%% close log files
 iolog.close()
@@ -39,58 +39,98 @@ along with this program.  If not, see https://www.gnu.org/licenses
 """
 
 import numpy as np
-from scipy.sparse import coo_matrix
+from scipy.sparse import csr_matrix
+from scipy.spatial import cKDTree
+from scipy.sparse._sparsetools import csr_matvec
+from numba import njit
 
-def get_sfil(N,sym,elepos,Q,rsen):
+def get_balls(N,sym,elepos,r,blk=512):
+    # elements of the extended mesh within distance r of each element (ascending order)
+    # and their squared distances (concatenated in the same order)
+    tree = cKDTree(elepos)
+    ex = elepos[:,0].copy()
+    ey = elepos[:,1].copy()
     clist = []
+    d2list = []
     csize = np.ndarray((N),dtype=np.uint32)
-    for e in range(N):
-        et = sym[e,0]
-        c = np.argwhere(np.sum((elepos[et,:]-elepos)**2,axis=1) <= rsen**2)
-        clist = clist + [c[:,0]]
-        csize[e] = len(c)
-    size = sum(csize)
-    row = np.ndarray((size),dtype=np.uint32)
-    col = np.ndarray((size),dtype=np.uint32)
-    data = np.ndarray((size))
-    i = 0
-    for e in range(N):
-        et = sym[e,0]
-        c = clist[e]
-        num = csize[e]
-        weights = rsen - np.linalg.norm(elepos[et,:]-elepos[c,:],axis=1)
-        weights = weights/sum(weights)
-        row[i:i+num] = np.repeat(e,num)
-        col[i:i+num] = c
-        data[i:i+num] = weights
-        i = i + num
-    Sf = coo_matrix((data,(row,col)),shape=(N,10*N))
-    Sf = Sf.tocsr()
+    # blocks of blk elements keep the candidate pairs of each pass cache-sized
+    for s in range(0,N,blk):
+        e = min(s+blk,N)
+        balls = tree.query_ball_point(elepos[sym[s:e,0],:],r*(1.0+1e-9),return_sorted=True)
+        nb = np.fromiter(map(len,balls),dtype=np.int64,count=e-s)
+        # exact distance check of all candidate pairs in one pass (coordinates as separate arrays)
+        et = np.repeat(sym[s:e,0],nb)
+        c = np.concatenate(balls).astype(np.int64)
+        d2 = (ex[et]-ex[c])**2 + (ey[et]-ey[c])**2
+        keep = d2 <= r**2
+        csize[s:e] = np.bincount(np.repeat(np.arange(e-s),nb)[keep],minlength=e-s)
+        clist = clist + np.split(c[keep],np.cumsum(csize[s:e])[:-1])
+        d2list = d2list + [d2[keep]]
+    return clist, csize, np.concatenate(d2list)
+
+def get_sfil(N,sym,elepos,Q,rsen):
+    # Q : symmetry operator (extended mesh > design domain), CSR with sorted indices
+    clist, csize, d2 = get_balls(N,sym,elepos,rsen)
+    # rows are contiguous segments with sorted unique columns, so the CSR arrays are built directly
+    indptr = np.zeros((N+1),dtype=np.int32)
+    np.cumsum(csize,out=indptr[1:])
+    col = np.concatenate(clist).astype(np.int32)
+    weights = rsen - np.sqrt(d2)
+    # normalize the weights of each row
+    data = weights/np.repeat(np.add.reduceat(weights,indptr[:-1]),csize)
+    Sf = csr_matrix((data,col,indptr),shape=(N,10*N))
     Sf = Sf @ Q
+    Sf.sort_indices()
     return Sf
 
 def get_mope(N,sym,elepos,Q,rmor):
-    clist = []
-    csize = np.ndarray((N),dtype=np.uint32)
-    for e in range(N):
-        et = sym[e,0]
-        c = np.argwhere(np.sum((elepos[et,:]-elepos)**2,axis=1) <= rmor**2)
-        clist = clist + [c[:,0]]
-        csize[e] = len(c)
-    size = sum(csize)
-    row = np.ndarray((size),dtype=np.uint32)
-    col = np.ndarray((size),dtype=np.uint32)
-    data = np.ndarray((size))
-    i = 0
-    for e in range(N):
-        et = sym[e,0]
-        c = clist[e]
-        num = csize[e]
-        row[i:i+num] = np.repeat(e,num)
-        col[i:i+num] = c
-        data[i:i+num] = 1.0
-        i = i + num
-    Mf = coo_matrix((data,(row,col)),shape=(N,10*N))
-    Mf = Mf.tocsr()
+    clist, csize, _ = get_balls(N,sym,elepos,rmor)
+    size = int(csize.sum())
+    indptr = np.zeros((N+1),dtype=np.int32)
+    np.cumsum(csize,out=indptr[1:])
+    col = np.concatenate(clist).astype(np.int32)
+    data = np.ones((size))
+    Mf = csr_matrix((data,col,indptr),shape=(N,10*N))
     Mf = Mf @ Q
-    return Mf
\ No newline at end of file
+    Mf.sort_indices()
+    return Mf
+
+def apply_fil(F,v,out):
+    # out = F @ v (F in CSR format), written into a preallocated vector
+    out[:] = 0.0
+    csr_matvec(F.shape[0],F.shape[1],F.indptr,F.indices,F.data,v,out)
+    return
+
+@njit(cache=True)
+def update_mom(mom,fil,momentum):
+    # mom = momentum*mom + (1-momentum)*fil/max|fil|, normalized in place by max|mom|
+    maxfil = 0.0
+    for i in range(len(fil)):
+        maxfil = max(maxfil,abs(fil[i]))
+    maxmom = 0.0
+    for i in range(len(fil)):
+        mom[i] = momentum*mom[i] + (1.0-momentum)*fil[i]/maxfil
+        maxmom = max(maxmom,abs(mom[i]))
+    for i in range(len(fil)):
+        mom[i] = mom[i]/maxmom
+    return
+
+@njit(cache=True)
+def erode(y,indptr,indices,work):
+    # y[Mf[~y,:].indices] = False (Mf in CSR format), work is a preallocated copy of y
+    work[:] = y
+    for r in range(len(y)):
+        if not work[r]:
+            for i in range(indptr[r],indptr[r+1]):
+                y[indices[i]] = False
+    return
+
+@njit(cache=True)
+def dilate(y,indptr,indices,work):
+    # y[Mf[y,:].indices] = True (Mf in CSR format), work is a preallocated copy of y
+    work[:] = y
+    for r in range(len(y)):
+        if work[r]:
+            for i in range(indptr[r],indptr[r+1]):
+                y[indices[i]] = True
+    return
\ No newline at end of file
@@ -40,6 +40,7 @@ along with this program.  If not, see https://www.gnu.org/licenses
 
 import numpy as np
 import pulp as pp
+from numba import njit
 
 def solve_ILP(N,x,alpha,alpha_h,h_bar,h_lim,dXmax,sense='min',sense_h='L',tLim=np.infty,rErr=None,verbose=False):
     # Integer Linear Programming problem
@@ -91,7 +92,7 @@ def solve_BESO(N,x,alpha,dXmax,sense='min'):
         mask = (x & (alpha>0.0)) | (~x & (alpha<0.0))
     else:               # maximization problem
         mask = (x & (alpha<0.0)) | (~x & (alpha>0.0))
-    Nv = sum(mask)
+    Nv = np.count_nonzero(mask)
     if Nv == 0:
         return y
     xsub = x[mask]
@@ -101,4 +102,14 @@ def solve_BESO(N,x,alpha,dXmax,sense='min'):
     else:
         xsub[arg[-dXmax:]] = ~xsub[arg[-dXmax:]]
     y[mask] = xsub
-    return y
\ No newline at end of file
+    return y
+
+@njit(cache=True)
+def build_selection(x,alpha,alpha_h,small,out):
+    # candidate variables of the ILP (one pass over the design), written into out
+    for e in range(len(x)):
+        if x[e]:
+            out[e] = (alpha[e] > -small) or (alpha_h[e] < small)
+        else:
+            out[e] = (alpha[e] < small) or (alpha_h[e] > -small)
+    return
\ No newline at end of file
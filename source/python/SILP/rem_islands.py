@@ -39,48 +39,123 @@ along with this program.  If not, see https://www.gnu.org/licenses
 """
 
 import numpy as np
-import sys
+from numba import njit
 
-sys.setrecursionlimit(100000)
-def visit(e,x,continent,neighbors):
-    continent[e] = True
-    for ee in neighbors[e,:]:
-        if x[ee] and (not continent[ee]):
-            visit(ee,x,continent,neighbors)
+@njit(cache=True)
+def flood_fill(seed,x,continent,neighbors):
+    # mark in continent the solid elements connected to seed (iterative depth-first search)
+    stack = np.empty(neighbors.shape[0],dtype=np.int64)
+    continent[seed] = True
+    stack[0] = seed
+    top = 1
+    while top > 0:
+        top = top - 1
+        e = stack[top]
+        for k in range(neighbors.shape[1]):
+            ee = neighbors[e,k]
+            if (ee != -1) and x[ee] and (not continent[ee]):
+                continent[ee] = True
+                stack[top] = ee
+                top = top + 1
     return
 
+@njit(cache=True)
+def remove_islands(y,neighbors,Ns,N):
+    voly = y.sum()/N
+    # visited elements as a bitset (element e is bit e&63 of word e>>6)
+    visited = np.zeros(N//64+1,dtype=np.uint64)
+    one = np.uint64(1)
+    continent_vol = 0.0
+    # elements in order of visit, each connected component is a contiguous range
+    order = np.empty(N,dtype=np.int32)
+    start = 0
+    count = 0
+    for e in list(range(0,Ns)) + list(range(Ns,N,Ns)):
+        if y[e] and ((visited[e>>6] >> np.uint64(e&63)) & one) == 0:
+            # breadth-first traversal of the solid elements connected to e
+            visited[e>>6] |= one << np.uint64(e&63)
+            start = count
+            order[count] = e
+            count = count + 1
+            head = start
+            while head < count:
+                ee = order[head]
+                head = head + 1
+                for k in range(neighbors.shape[1]):
+                    en = neighbors[ee,k]
+                    bit = one << np.uint64(en&63)
+                    if y[en] and (visited[en>>6] & bit) == 0:
+                        visited[en>>6] |= bit
+                        order[count] = en
+                        count = count + 1
+            continent_vol = (count-start)/N
+            if continent_vol > 0.50*voly:
+                break
+    continent = np.zeros(N,dtype=np.bool_)
+    for i in range(start,count):
+        continent[order[i]] = True
+    return continent, continent_vol
+
 def get_neighbors(Ns,inci,inci_lb,inci_bot,sym,sym_lb,sym_bot):
     N = Ns**2
     Mf = 1 + 6*Ns*(Ns+1) + Ns + 4*N
-    Nf = 10*N
-    finci = np.vstack((inci,inci_lb,inci_bot))
-    fsym = np.hstack((sym,sym_lb,sym_bot))
-    nodes = -np.ones((Mf,6),dtype=int)
-    counter = np.zeros(Mf,dtype=int)
+    finci = np.vstack((inci,inci_lb,inci_bot)).astype(np.int64)
+    fsym = np.hstack((sym,sym_lb,sym_bot)).astype(np.int64)
+    return find_neighbors(N,Mf,finci,fsym)
+
+@njit(cache=True)
+def find_neighbors(N,Mf,finci,fsym):
+    Nf = finci.shape[0]
+    # elements of each node in CSR layout (elements of node n : node_inc[node_ptr[n]:node_ptr[n+1]])
+    node_ptr = np.zeros(Mf+1,dtype=np.int64)
+    for e in range(Nf):
+        for k in range(4):
+            node_ptr[finci[e,k]+1] += 1
+    for n in range(Mf):
+        node_ptr[n+1] += node_ptr[n]
+    node_inc = np.empty(node_ptr[Mf],dtype=np.int64)
+    pos = node_ptr[:Mf].copy()
     for e in range(Nf):
         for k in range(4):
             n = finci[e,k]
-            nodes[n,counter[n]] = e
-            counter[n] += 1
-    neighbors_extended = -np.ones((Nf,4),dtype=int)
-    counter = np.zeros(Nf,dtype=int)
+            node_inc[pos[n]] = e
+            pos[n] += 1
+    neighbors_extended = -np.ones((Nf,4),dtype=np.int64)
+    counter = np.zeros(Nf,dtype=np.int64)
     for e in range(Nf):
         for k in range(4):
             n = finci[e,k]
-            for kk in range(6):
-                ee = nodes[n,kk]
-                if (ee != e) and (ee != -1):
-                    if ee not in neighbors_extended[e,:]:
-                        if len(np.setdiff1d(finci[e,:],finci[ee,:],assume_unique=True)) == 2:
+            for j in range(node_ptr[n],node_ptr[n+1]):
+                ee = node_inc[j]
+                if ee != e:
+                    found = False
+                    for i in range(counter[e]):
+                        if neighbors_extended[e,i] == ee:
+                            found = True
+                    if not found:
+                        # number of nodes of e that are not nodes of ee
+                        diff = 0
+                        for a in range(4):
+                            hit = False
+                            for b in range(4):
+                                if finci[e,a] == finci[ee,b]:
+                                    hit = True
+                            if not hit:
+                                diff += 1
+                        if diff == 2:
                             neighbors_extended[e,counter[e]] = ee
                             counter[e] += 1
+    # element of the base cell of each extended element (first occurrence in fsym)
+    inv = -np.ones(Nf,dtype=np.int64)
+    for e in range(fsym.shape[0]-1,-1,-1):
+        for k in range(fsym.shape[1]-1,-1,-1):
+            inv[fsym[e,k]] = e
     neighbors_ext = neighbors_extended.copy()
     for ef in range(Nf):
         for k in range(4):
             if neighbors_extended[ef,k] != -1:
-                e = np.argwhere(fsym==neighbors_extended[ef,k])[0,0]
-                neighbors_ext[ef,k] = e
-    neighbors = np.ndarray((N,4),dtype=int)
+                neighbors_ext[ef,k] = inv[neighbors_extended[ef,k]]
+    neighbors = np.empty((N,4),dtype=np.int64)
     for k in range(N):
         neighbors[k,:] = neighbors_ext[fsym[k,0],:]
     return neighbors
\ No newline at end of file
@@ -0,0 +1,89 @@
+"""
+Dataset Generation
+Topology Optimization of the Base Cell of a Periodic Metamaterial
+--------------------------------------------------------------------
+Laboratory of Topology Optimization and Multiphysics Analysis
+Department of Computational Mechanics
+School of Mechanical Engineering
+University of Campinas (Brazil)
+--------------------------------------------------------------------
+author  : Daniel Candeloro Cunha
+version : 1.0
+date    : May 2023
+--------------------------------------------------------------------
+To collaborate or report bugs, please look for the author's email
+address at https://www.fem.unicamp.br/~ltm/
+
+All codes and documentation are publicly available in the following
+github repository: https://github.com/Joquempo/Metamaterial-Dataset
+
+If you use this program (or the data generated by it) in your work,
+the developer would be grateful if you would cite the indicated
+references. They are listed in the "CITEAS" file available in the
+github repository.
+--------------------------------------------------------------------
+Copyright (C) 2023 Daniel Candeloro Cunha
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see https://www.gnu.org/licenses
+"""
+
+import numpy as np
+from struct import pack
+
+def extend_buffers(buf):
+    # double the number of rows of every storage buffer, keeping stored rows
+    for name in buf:
+        old = buf[name]
+        if isinstance(old,np.memmap):
+            # memory-mapped buffers grow in place on disk
+            old.flush()
+            buf[name] = np.memmap(old.filename,dtype=old.dtype,mode='r+',offset=old.offset,
+                                  shape=(2*old.shape[0],)+old.shape[1:])
+        else:
+            buf[name] = np.ndarray((2*old.shape[0],)+old.shape[1:],dtype=old.dtype)
+            buf[name][:old.shape[0]] = old
+    return
+
+def npy_header(shape,dtype,align=4096):
+    # .npy header (format 1.0) padded so that the data starts at a multiple of align bytes
+    header = "{{'descr': {!r}, 'fortran_order': False, 'shape': {!r}, }}".format(
+        np.lib.format.dtype_to_descr(np.dtype(dtype)),tuple(shape))
+    size = 10 + len(header) + 1  # magic string + version + header length + header + newline
+    header = header + ' '*(-size % align) + '\n'
+    return np.lib.format.magic(1,0) + pack('<H',len(header)) + header.encode('latin1')
+
+def save_aligned(fname,arr,align=4096):
+    # np.save with the header padded so that the data starts at a multiple of align bytes
+    arr = np.ascontiguousarray(arr)
+    with open(fname,'wb') as f:
+        f.write(npy_header(arr.shape,arr.dtype,align))
+        arr.tofile(f)
+    return
+
+def open_buffer(fname,nrow,rowshape,dtype,align=4096):
+    # storage buffer memory-mapped to the data section of the .npy file fname
+    mm = np.memmap(fname,dtype=dtype,mode='w+',offset=align,shape=(nrow,)+rowshape)
+    # provisional header (no rows) keeps the file a valid .npy until close_buffer
+    with open(fname,'r+b') as f:
+        f.write(npy_header((0,)+rowshape,dtype,align))
+    return mm
+
+def close_buffer(mm,nrow):
+    # rewrite the header for the first nrow rows of a memory-mapped buffer and drop the remaining rows
+    mm.flush()
+    shape = (nrow,)+mm.shape[1:]
+    with open(mm.filename,'r+b') as f:
+        f.write(npy_header(shape,mm.dtype,mm.offset))
+        f.truncate(mm.offset + nrow*mm[0].nbytes)
+    return
\ No newline at end of file
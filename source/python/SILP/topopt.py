@@ -39,38 +39,106 @@ along with this program.  If not, see https://www.gnu.org/licenses
 """
 
 import numpy as np
+from numba import njit
 
-def update(x,etype,sym,pk,Ketvec,P,Kg_coo,Zr,shift,Uhat,factor,elist,solve_sys=True):
+def csc_perm(row,col,A):
+    # position of each COO entry (row,col) in the data array of A (CSC with sorted indices)
+    nrow = A.shape[0]
+    acol = np.repeat(np.arange(A.shape[1],dtype=np.int64),np.diff(A.indptr))
+    keys = acol*nrow + A.indices
+    return np.searchsorted(keys,col.astype(np.int64)*nrow + row)
+
+def reduced_perm(P,A,Ar):
+    # position of each entry of A (CSC) in the data array of Ar = P.T @ A @ P (CSC with sorted indices)
+    # P has at most one non-zero (equal to 1) per row, entries on empty rows of P are marked with -1
+    Pcoo = P.tocoo()
+    pmap = -np.ones(P.shape[0],dtype=np.int64)
+    pmap[Pcoo.row] = Pcoo.col
+    prow = pmap[A.indices]
+    pcol = pmap[np.repeat(np.arange(A.shape[1]),np.diff(A.indptr))]
+    mask = (prow >= 0) & (pcol >= 0)
+    rperm = -np.ones(len(A.data),dtype=np.int64)
+    rperm[mask] = csc_perm(prow[mask],pcol[mask],Ar)
+    return rperm
+
+@njit(cache=True)
+def csc_assemble_fixed(data_coo,perm,out_data):
+    # out_data = CSC data of the COO matrix with entries data_coo (positions given by csc_perm)
+    # entries with negative positions are dropped
+    out_data[:] = 0.0
+    for i in range(len(data_coo)):
+        if perm[i] >= 0:
+            out_data[perm[i]] += data_coo[i]
+    return
+
+def update(x,etype,sym,pk,Ketvec,P,Kg_data,Kg_csc,perm,Kr,rperm,Uhat,factor,elist,inci,Ket,Che,Chat,solve_sys=True):
+    # Chat = Uhat.T @ Kg @ Uhat is updated in place from the element energies Che
     x[elist] = ~x[elist]
-    for e in elist:
-        if x[e]:
-            for k in range(6):
-                et = sym[e,k]
-                ek = etype[et]
-                Kg_coo.data[64*et:64*et+64] = Ketvec[ek,:]
-        else:
-            for k in range(6):
-                et = sym[e,k]
-                ek = etype[et]
-                Kg_coo.data[64*et:64*et+64] = pk*Ketvec[ek,:]
+    pen = np.where(x[elist],1.0,pk)
+    Chat += np.tensordot(np.where(x[elist],1.0-pk,pk-1.0),Che[elist],axes=1)
+    ets = sym[elist,:].ravel()
+    Kg_data.reshape(-1,64)[ets] = np.repeat(pen,6)[:,None]*Ketvec[etype[ets]]
     if solve_sys:
-        Kg_csc = Kg_coo.tocsc()
-        Kr = P.T @ Kg_csc @ P
-        Kr = Kr + shift*Zr
-        Kr.sort_indices()
-        Kr.data = Kr.data - shift*Zr.data
+        csc_assemble_fixed(Kg_data,perm,Kg_csc.data)
+        # Kr = P.T @ Kg_csc @ P (fixed pattern)
+        csc_assemble_fixed(Kg_csc.data,rperm,Kr.data)
         Fr = -P.T @ Kg_csc @ Uhat
         factor.cholesky_inplace(Kr)
-        Ur = factor(Fr)
+        Ur = factor.solve_A(Fr)
         Ug = Uhat + P @ Ur
-        return Ug, Kr
+        # Ug.T @ Kg @ Ug = Uhat.T @ Kg @ Uhat - Fr.T @ Ur
+        Ch = Chat - Fr.T @ Ur
+        Ch = 0.5*(Ch+Ch.T)
+        # element-wise sum if the subtraction cancels too many digits
+        if min(Ch[0,0]/Chat[0,0],Ch[2,2]/Chat[2,2]) < 1e-4:
+            Ch = homogenize(x,sym,etype,inci,pk,Ket,Ug)
+        return Ug, Ch
     return
 
-def ws(x,aug_etype,sym,P,factor,inci,Ug,Hlist):
+@njit(cache=True)
+def elem_energy(sym,etype,inci,Ket,Ug):
+    # Che[e] = Ue.T @ Ke @ Ue summed over the 6 symmetric elements of e (no penalization)
+    N = sym.shape[0]
+    Che = np.zeros((N,3,3))
+    Ue = np.empty((8,3))
+    for e in range(N):
+        for k in range(6):
+            et = sym[e,k]
+            Ke = Ket[etype[et]]
+            for kk in range(4):
+                n = inci[et,kk]
+                for i in range(3):
+                    Ue[2*kk,i] = Ug[2*n,i]
+                    Ue[2*kk+1,i] = Ug[2*n+1,i]
+            for i in range(3):
+                for j in range(i,3):
+                    w = 0.0
+                    for ii in range(8):
+                        kw = 0.0
+                        for jj in range(8):
+                            kw += Ke[ii,jj]*Ue[jj,j]
+                        w += Ue[ii,i]*kw
+                    Che[e,i,j] += w
+        for i in range(3):
+            for j in range(i):
+                Che[e,i,j] = Che[e,j,i]
+    return Che
+
+@njit(cache=True)
+def homogenize(x,sym,etype,inci,pk,Ket,Ug):
+    # Ch = Ug.T @ Kg @ Ug, accumulated element by element
+    Che = elem_energy(sym,etype,inci,Ket,Ug)
+    Ch = np.zeros((3,3))
+    for e in range(len(x)):
+        if x[e]:
+            Ch += Che[e]
+        else:
+            Ch += pk*Che[e]
+    return Ch
+
+def ws(x,aug_etype,sym,P,factor,inci,Ug,Hlist,dC_w):
+    # dC_w[0], dC_w[1] and dC_w[2] receive dC00, dC11 and dC22
     N = len(x)
-    dC00_w = np.ndarray((N))
-    dC11_w = np.ndarray((N))
-    dC22_w = np.ndarray((N))
     eledofs = np.ndarray((6,8),dtype=np.uint32)
     for e in range(N):
         for k in range(6):
@@ -104,7 +172,7 @@ def ws(x,aug_etype,sym,P,factor,inci,Ug,Hlist):
             dCh = -Ve.T @ np.linalg.solve(Ie-Ae,Ve)
         else:
             dCh =  Ve.T @ np.linalg.solve(Ie+Ae,Ve)
-        dC00_w[e] = dCh[0,0]
-        dC11_w[e] = dCh[1,1]
-        dC22_w[e] = dCh[2,2]
-    return dC00_w, dC11_w, dC22_w
\ No newline at end of file
+        dC_w[0,e] = dCh[0,0]
+        dC_w[1,e] = dCh[1,1]
+        dC_w[2,e] = dCh[2,2]
+    return
\ No newline at end of file
@@ -53,8 +53,8 @@ sys.path.append('../source/python/SILP/')
 from elem import get_emat, get_augmat, getB
 from mesh import get_mesh, get_fmesh
 from filters import get_sfil, get_mope
-from rem_islands import visit, get_neighbors
-from topopt import update, ws
+from rem_islands import flood_fill, get_neighbors
+from topopt import csc_perm, reduced_perm, update, elem_energy, homogenize, ws
 
 sys.path.append('../source/cython/')
 from silp_sens import cgs
@@ -106,7 +106,7 @@ row = fsym.ravel('C')
 col = np.repeat(np.arange(N),10)
 data = np.ones(10*N)
 Q = coo_matrix((data,(row,col)),shape=(10*N,N))
-Q = Q.tocsc()
+Q = Q.tocsr()
 # sensitivity filter matrix
 Sf = get_sfil(N,sym,elepos,Q,rsen)
 # morphology filter matrix
@@ -293,6 +293,13 @@ e3 = abs(Ch4[0,2]) + abs(Ch4[1,2]) + abs(Ch4[2,0]) + abs(Ch4[2,1])
 e4 = abs(Ch4[0,0] - Ch4[1,0] - 2.0*Ch4[2,2])
 print('> > error_4 = {:.4e} %'.format(100*max([e1,e2,e3,e4])/abs(Ch4).max()))
 
+print('> Element-wise homogenization...')
+e1 = abs(homogenize(x1,sym,etype,inci,pk,Ket,Ug1)-Ch1).max()/abs(Ch1).max()
+e2 = abs(homogenize(x2,sym,etype,inci,pk,Ket,Ug2)-Ch2).max()/abs(Ch2).max()
+e3 = abs(homogenize(x3,sym,etype,inci,pk,Ket,Ug3)-Ch3).max()/abs(Ch3).max()
+e4 = abs(homogenize(x4,sym,etype,inci,pk,Ket,Ug4)-Ch4).max()/abs(Ch4).max()
+print('> > error_ew : {:.4e} %'.format(100*max([e1,e2,e3,e4])))
+
 print('> Anti-symmetric loads over the edges of the base cell...')
 plt.figure(num=0).clear()
 plt.title('External loads for each case',y=-0.05)
@@ -436,11 +443,18 @@ print('[Topology Update]')
 print('> Check vectors and matrices...')
 x = x1.copy()
 Kg_coo = Kg_coo1.copy()
+Kg_csc = Kg_csc1.copy()
+perm = csc_perm(row,col,Kg_csc)
+Kr = Kr1.copy()
+rperm = reduced_perm(P,Kg_csc,Kr)
 elist = list(np.argwhere(x1!=x4)[:,0])
-Ug, Kr = update(x,etype,sym,pk,Ketvec,P,Kg_coo,Zr,shift,Uhat,factor,elist)
+Che = elem_energy(sym,etype,inci,Ket,Uhat)
+Chat = homogenize(x,sym,etype,inci,pk,Ket,Uhat)
+Ug, Ch = update(x,etype,sym,pk,Ketvec,P,Kg_coo.data,Kg_csc,perm,Kr,rperm,Uhat,factor,elist,inci,Ket,Che,Chat)
 e1 = abs(Ug-Ug4).max()/abs(Ug).max()
-e2 = len((Kr-Kr4).data)/len(Kr.data)
-print('> > error_1_to_4 : {:.4e} %'.format(100*max([e1,e2])))
+e2 = abs((Kr-Kr4).data).max()/abs(Kr4.data).max()
+e3 = abs(Ch-Ch4).max()/abs(Ch4).max()
+print('> > error_1_to_4 : {:.4e} %'.format(100*max([e1,e2,e3])))
 
 print('> Shift maneuver...')
 Kg_coo = Kg_coo4.copy()
@@ -537,7 +551,9 @@ e3 = abs(dCh_2[:,2,2]-dC22_2).max()/abs(dC22_2).max()
 print('> > error_CGS-2 : {:.4e} %'.format(100*max([e1,e2,e3])))
 
 print('> Check sign and monotonic behavior of delta_Ch...')
-dC00_w, dC11_w, dC22_w = ws(x4,aug_etype,sym,P,factor,inci,Ug4,Hlist)
+dC_w = np.ndarray((3,N))
+ws(x4,aug_etype,sym,P,factor,inci,Ug4,Hlist,dC_w)
+dC00_w, dC11_w, dC22_w = dC_w
 print('> > negative values for solid elements : {}'.format(
      all(dC00_0[x4] < small) and all(dC00_1[x4] < small) and all(dC00_2[x4] < small) and all(dC00_w[x4] < small) and
      all(dC11_0[x4] < small) and all(dC11_1[x4] < small) and all(dC11_2[x4] < small) and all(dC11_w[x4] < small) and
@@ -871,7 +887,7 @@ continent = np.zeros(N,dtype=bool)
 for e in (list(range(0,Ns))+list(range(Ns,Nt,Ns))):
     if y[e] and (not continent[e]):
         continent = np.zeros(N,dtype=bool)    
-        visit(e,y,continent,neighbors)
+        flood_fill(e,y,continent,neighbors)
         continent_vol = sum(continent)/N
         break
 islands = (y!=continent)
@@ -911,7 +927,7 @@ continent = np.zeros(N,dtype=bool)
 for e in (list(range(0,Ns))+list(range(Ns,Nt,Ns))):
     if y[e] and (not continent[e]):
         continent = np.zeros(N,dtype=bool)    
-        visit(e,y,continent,neighbors)
+        flood_fill(e,y,continent,neighbors)
         continent_vol = sum(continent)/N
         break
 islands = (y!=continent)
@@ -956,7 +972,7 @@ continent = np.zeros(N,dtype=bool)
 for e in (list(range(0,Ns))+list(range(Ns,Nt,Ns))):
     if y[e] and (not continent[e]):
         continent = np.zeros(N,dtype=bool)    
-        visit(e,y,continent,neighbors)
+        flood_fill(e,y,continent,neighbors)
         continent_vol = sum(continent)/N
         break
 islands = (y!=continent)